@@ -1,4 +1,9 @@
+import asyncio
+import functools
 import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import click
 import google.auth
 import vertexai
@@ -6,15 +11,30 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.adk.artifacts import GcsArtifactService
 from vertexai._genai.types import AgentEngine, AgentEngineConfig
 from vertexai.agent_engines.templates.adk import AdkApp
-from typing import Any
+from typing import Any, AsyncGenerator, Iterator
 
-from app.agent import root_agent
+from app.agent import (
+    VISION_BUCKET_NAME,
+    VISION_TTL_DAYS,
+    root_agent,
+    start_background_setup,
+)
 from app.utils.deployment import (
     parse_env_vars,
     print_deployment_success,
     write_deployment_metadata,
 )
-from app.utils.gcs import create_bucket_if_not_exists
+from app.utils.gcs import (
+    create_bucket_if_not_exists,
+    create_public_bucket_if_not_exists,
+)
+
+# Guards lazy creation of the per-app event loop. Kept at module level because
+# the app instance itself is pickled on deploy.
+_LOOP_LOCK = threading.Lock()
+
+# Holds references to fire-and-forget tasks until they finish.
+_BACKGROUND_TASKS: set[asyncio.Task[None]] = set()
 
 
 class AgentEngineApp(AdkApp):
@@ -22,85 +42,127 @@ class AgentEngineApp(AdkApp):
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
         # AdkApp stores the agent in self._tmpl_attrs['agent']
+        # The loop is started on first query so the app stays picklable.
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._ops_cache: dict[str, list[str]] | None = None
+
+    def set_up(self) -> None:
+        """
+        Sets up the app and starts loading the vision clients in the
+        background, so the first query does not wait for them.
+        """
+        super().set_up()
+        start_background_setup()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Returns the long-lived background event loop, starting it on first use.
+        """
+        with _LOOP_LOCK:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    async def _delete_session(self, user_id: str, session_id: str) -> None:
+        """
+        Deletes a finished query's session, logging instead of raising on
+        failure since nobody is waiting on the result.
+        """
+        try:
+            await self.async_delete_session(user_id=user_id,
+                                            session_id=session_id)
+        except Exception as e:
+            logging.warning("Failed to delete session %s: %s", session_id, e)
+
+    async def _stream_text(self, input: str) -> AsyncGenerator[str, None]:
+        """
+        Runs the agent on the given input and yields the text of each
+        response part as its event arrives.
+        """
+        # 1. Ensure app is set up (services, runner, etc.)
+        if not self._tmpl_attrs.get("runner"):
+            self.set_up()
+
+        # 2. Create a session using the configured session service
+        # using a dummy user_id for this stateless query
+        user_id = "default_user"
+        session = await self.async_create_session(user_id=user_id)
+
+        try:
+            # 3. Use the configured runner to execute
+            # We iterate over events to pass on the text response
+            runner = self._tmpl_attrs.get("runner")
+            assert runner is not None
+
+            # Convert input string to Content object if needed,
+            # but runner.run_async handles string/Content.
+            # Actually run_async takes 'new_message'.
+            from google.genai import types
+            message = types.Content(role="user",
+                                    parts=[types.Part(text=input)])
+
+            async for event in runner.run_async(user_id=user_id,
+                                                session_id=session.id,
+                                                new_message=message):
+                # Check for final response text
+                # (This logic mimics how typical UI clients assemble the response)
+                if event.content and event.content.parts:
+                    for part in event.content.parts:
+                        if part.text:
+                            yield part.text
+        finally:
+            # 4. Clean up session in the background; the response does
+            # not depend on it, so do not make the caller wait for it.
+            task = asyncio.create_task(
+                self._delete_session(user_id=user_id, session_id=session.id))
+            _BACKGROUND_TASKS.add(task)
+            task.add_done_callback(_BACKGROUND_TASKS.discard)
 
     def query(self, input: str) -> str:
         """
         Queries the agent with the given input and returns the complete,
         blocking response.
         """
-        import asyncio
-        import threading
 
-        # Helper to run async query using AdkApp's proper infrastructure
         async def _run_async() -> str:
-            # 1. Ensure app is set up (services, runner, etc.)
-            if not self._tmpl_attrs.get("runner"):
-                self.set_up()
-
-            # 2. Create a session using the configured session service
-            # using a dummy user_id for this stateless query
-            user_id = "default_user"
-            session = await self.async_create_session(user_id=user_id)
-
-            response_text = ""
-            try:
-                # 3. Use the configured runner to execute
-                # We iterate over events to accumulate the text response
-                runner = self._tmpl_attrs.get("runner")
-                assert runner is not None
-
-                # Convert input string to Content object if needed,
-                # but runner.run_async handles string/Content.
-                # Actually run_async takes 'new_message'.
-                from google.genai import types
-                message = types.Content(role="user",
-                                        parts=[types.Part(text=input)])
-
-                async for event in runner.run_async(user_id=user_id,
-                                                    session_id=session.id,
-                                                    new_message=message):
-                    # Check for final response text
-                    # (This logic mimics how typical UI clients assemble the response)
-                    if event.content and event.content.parts:
-                        for part in event.content.parts:
-                            if part.text:
-                                response_text += part.text
-            finally:
-                # 4. Clean up session
-                await self.async_delete_session(user_id=user_id,
-                                                session_id=session.id)
-
-            return response_text
-
-        # Container for result or exception
-        result_container: dict[str, Any] = {"data": None, "error": None}
-
-        def run_in_thread() -> None:
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            try:
-                result_container["data"] = new_loop.run_until_complete(
-                    _run_async())
-            except Exception as e:
-                result_container["error"] = e
-                logging.error(f"Error in async execution: {e}", exc_info=True)
-            finally:
-                new_loop.close()
-
-        # Always run in a thread to be safe in Vertex AI environment
-        t = threading.Thread(target=run_in_thread)
-        t.start()
-        t.join()
-
-        if result_container["error"]:
-            raise result_container["error"]
-
-        return result_container["data"] or ""
+            return "".join([text async for text in self._stream_text(input)])
+
+        # Run on the shared loop thread so concurrent queries neither pay for
+        # a new loop each time nor lose clients bound to the loop.
+        future = asyncio.run_coroutine_threadsafe(_run_async(),
+                                                  self._get_loop())
+        try:
+            return future.result()
+        except Exception as e:
+            logging.error("Error in async execution: %s", e, exc_info=True)
+            raise
+
+    def stream_text_query(self, input: str) -> Iterator[str]:
+        """
+        Queries the agent with the given input and yields the response text
+        as it is produced, instead of waiting for the whole run.
+        """
+        loop = self._get_loop()
+        chunks = self._stream_text(input)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(
+                        chunks.__anext__(), loop).result()
+                except StopAsyncIteration:
+                    return
+        finally:
+            asyncio.run_coroutine_threadsafe(chunks.aclose(), loop).result()
 
     def register_operations(self) -> dict[str, list[str]]:
         """
         Registers operations, filtering out async modes that crash the client.
         """
+        if self._ops_cache is not None:
+            return self._ops_cache
+
         ops = super().register_operations()
 
         if "" not in ops:
@@ -108,14 +170,32 @@ class AgentEngineApp(AdkApp):
         if "query" not in ops[""]:
             ops[""].append("query")
 
+        if "stream" not in ops:
+            ops["stream"] = []
+        if "stream_text_query" not in ops["stream"]:
+            ops["stream"].append("stream_text_query")
+
         if "async" in ops:
             del ops["async"]
         if "async_stream" in ops:
             del ops["async_stream"]
 
+        self._ops_cache = ops
         return ops
 
 
+@functools.lru_cache(maxsize=4)
+def _load_requirements(path: str, mtime: float) -> tuple[str, ...]:
+    """
+    Reads the requirement lines of a file, skipping blanks and comments.
+    The mtime is only part of the cache key, so an edited file is re-read.
+    """
+    with open(path) as f:
+        lines = (line.strip() for line in f)
+        return tuple(line for line in lines
+                     if line and not line.startswith("#"))
+
+
 @click.command()
 @click.option(
     "--project",
@@ -189,12 +269,28 @@ def deploy_agent_engine_app(
         staging_bucket_uri = f"gs://{project}-agent-engine"
     if not artifacts_bucket_name:
         artifacts_bucket_name = f"{project}-agent-engine"
-    create_bucket_if_not_exists(bucket_name=artifacts_bucket_name,
-                                project=project,
-                                location=location)
-    create_bucket_if_not_exists(bucket_name=staging_bucket_uri,
-                                project=project,
-                                location=location)
+    # The bucket checks are independent round-trips, so run them together.
+    # By default both names point at the same bucket; check it only once so
+    # two concurrent creates cannot race each other.
+    bucket_names = {
+        name.removeprefix("gs://")
+        for name in (artifacts_bucket_name, staging_bucket_uri)
+    }
+    with ThreadPoolExecutor(max_workers=len(bucket_names)) as executor:
+        futures = [
+            executor.submit(create_bucket_if_not_exists,
+                            bucket_name=bucket_name,
+                            project=project,
+                            location=location) for bucket_name in bucket_names
+        ]
+        for future in futures:
+            future.result()
+    # Created here rather than by the agent, so the runtime never needs
+    # permission to create buckets or change their IAM policy.
+    create_public_bucket_if_not_exists(bucket_name=VISION_BUCKET_NAME,
+                                       project=project,
+                                       location=location,
+                                       ttl_days=VISION_TTL_DAYS)
 
     print("""
     ╔═══════════════════════════════════════════════════════════╗
@@ -214,8 +310,9 @@ def deploy_agent_engine_app(
     vertexai.init(project=project, location=location)
 
     # Read requirements
-    with open(requirements_file) as f:
-        requirements = f.read().strip().split("\n")
+    requirements = list(
+        _load_requirements(requirements_file,
+                           os.path.getmtime(requirements_file)))
 
     # Use our custom AgentEngineApp
     agent_engine = AgentEngineApp(
@@ -247,23 +344,25 @@ def deploy_agent_engine_app(
         "agent": agent_engine,
         "config": config,
     }
-    logging.info(f"Agent config: {agent_config}")
-
-    # Check if an agent with this name already exists
-    existing_agents = list(client.agent_engines.list())
-    matching_agents = [
-        agent for agent in existing_agents
-        if agent.api_resource.display_name == agent_name
-    ]
+    logging.info("Agent config: %s", agent_config)
+
+    # Check if an agent with this name already exists. Filter server-side
+    # and stop at the first match rather than paging through every agent.
+    existing_agent = next(
+        (agent for agent in client.agent_engines.list(
+            config={"filter": f'display_name="{agent_name}"'})
+         if agent.api_resource.display_name == agent_name),
+        None,
+    )
 
-    if matching_agents:
+    if existing_agent:
         # Update the existing agent with new configuration
-        logging.info(f"\n📝 Updating existing agent: {agent_name}")
+        logging.info("\n📝 Updating existing agent: %s", agent_name)
         remote_agent = client.agent_engines.update(
-            name=matching_agents[0].api_resource.name, **agent_config)
+            name=existing_agent.api_resource.name, **agent_config)
     else:
         # Create a new agent if none exists
-        logging.info(f"\n🚀 Creating new agent: {agent_name}")
+        logging.info("\n🚀 Creating new agent: %s", agent_name)
         remote_agent = client.agent_engines.create(**agent_config)
 
     write_deployment_metadata(remote_agent)
@@ -13,10 +13,42 @@
 # limitations under the License.
 
 import datetime
+import functools
 import json
 import logging
+import os
+import re
+import sys
 from typing import Any
 
+_UTC = datetime.timezone.utc
+_ENV_PAIR_RE = re.compile(r"\s*([^=,]*?)\s*=\s*([^,]*?)\s*(?:,|$)")
+_RESOURCE_NAME_RE = re.compile(r"projects/([^/]+)/(?:.*/)?([^/]+)$")
+_CONSOLE_URL_TMPL = (
+    "https://console.cloud.google.com/vertex-ai/agents/locations/{location}"
+    "/agent-engines/{agent_engine_id}?project={project}"
+)
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_env_pairs(
+    env_vars_string: str,
+) -> tuple[tuple[tuple[str, str], ...], tuple[str, ...]]:
+    """Split a KEY=VALUE string into stripped pairs and malformed pieces, cached."""
+    matched: list[tuple[str, str]] = _ENV_PAIR_RE.findall(env_vars_string)
+    if len(matched) == env_vars_string.count(",") + 1:
+        return tuple(matched), ()
+    # Some pair has no "=", so split again to find which ones
+    pairs = []
+    malformed = []
+    for pair in env_vars_string.split(","):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            pairs.append((key.strip(), value.strip()))
+        else:
+            malformed.append(pair)
+    return tuple(pairs), tuple(malformed)
+
 
 def parse_env_vars(env_vars_string: str | None) -> dict[str, str]:
     """Parse environment variables from a comma-separated KEY=VALUE string.
@@ -27,15 +59,17 @@ def parse_env_vars(env_vars_string: str | None) -> dict[str, str]:
     Returns:
         Dictionary of environment variables with keys and values stripped of whitespace
     """
-    env_vars = {}
-    if env_vars_string:
-        for pair in env_vars_string.split(","):
-            if "=" in pair:
-                key, value = pair.split("=", 1)
-                env_vars[key.strip()] = value.strip()
-            else:
-                logging.warning(f"Skipping malformed environment variable pair: {pair}")
-    return env_vars
+    if not env_vars_string:
+        return {}
+    if "," not in env_vars_string and "=" in env_vars_string:
+        key, value = env_vars_string.split("=", 1)
+        return {key.strip(): value.strip()}
+    pairs, malformed = _parse_env_pairs(env_vars_string)
+    # Warn on every call, not just the one that filled the cache
+    for pair in malformed:
+        logging.warning("Skipping malformed environment variable pair: %s", pair)
+    # A fresh dict per call so callers can mutate it without touching the cache
+    return dict(pairs)
 
 
 def write_deployment_metadata(
@@ -50,13 +84,19 @@ def write_deployment_metadata(
     """
     metadata = {
         "remote_agent_engine_id": remote_agent.api_resource.name,
-        "deployment_timestamp": datetime.datetime.now().isoformat(),
+        "deployment_timestamp": datetime.datetime.now(_UTC),
     }
 
-    with open(metadata_file, "w") as f:
-        json.dump(metadata, f, indent=2)
+    # Write beside the target and rename so readers never see a partial file
+    tmp_file = f"{metadata_file}.tmp"
+    encoder = json.JSONEncoder(
+        indent=2, ensure_ascii=False, default=datetime.datetime.isoformat
+    )
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.writelines(encoder.iterencode(metadata))
+    os.replace(tmp_file, metadata_file)
 
-    logging.info(f"Agent Engine ID written to {metadata_file}")
+    logging.info("Agent Engine ID written to %s", metadata_file)
 
 
 def print_deployment_success(
@@ -71,20 +111,29 @@ def print_deployment_success(
         location: GCP region where the agent was deployed
         project: GCP project ID
     """
+    api_resource = remote_agent.api_resource
+    service_account = api_resource.spec.service_account
     # Extract agent engine ID and project number for console URL
-    resource_name_parts = remote_agent.api_resource.name.split("/")
-    agent_engine_id = resource_name_parts[-1]
-    project_number = resource_name_parts[1]
-    console_url = f"https://console.cloud.google.com/vertex-ai/agents/locations/{location}/agent-engines/{agent_engine_id}?project={project}"
-    print(
-        "\n✅ Deployment successful! Test your agent: notebooks/adk_app_testing.ipynb"
-    )
-    service_account = remote_agent.api_resource.spec.service_account
-    if service_account:
-        print(f"Service Account: {service_account}")
+    resource_match = _RESOURCE_NAME_RE.match(api_resource.name)
+    if resource_match is None:
+        # The deploy already succeeded; report the raw name instead of failing
+        logging.warning(
+            "Unexpected agent engine resource name: %s", api_resource.name
+        )
+        location_line = f"Agent Engine: {api_resource.name}"
+        service_account = service_account or "(project default)"
     else:
-        default_sa = (
-            f"service-{project_number}@gcp-sa-aiplatform-re.iam.gserviceaccount.com"
+        project_number, agent_engine_id = resource_match.groups()
+        console_url = _CONSOLE_URL_TMPL.format(
+            location=location, agent_engine_id=agent_engine_id, project=project
         )
-        print(f"Service Account: {default_sa}")
-    print(f"\n📊 View in console: {console_url}\n")
+        location_line = f"📊 View in console: {console_url}"
+        service_account = (
+            service_account
+            or f"service-{project_number}@gcp-sa-aiplatform-re.iam.gserviceaccount.com"
+        )
+    sys.stdout.write(
+        "\n✅ Deployment successful! Test your agent: notebooks/adk_app_testing.ipynb\n"
+        f"Service Account: {service_account}\n"
+        f"\n{location_line}\n\n"
+    )
@@ -40,3 +40,48 @@ def create_bucket_if_not_exists(bucket_name: str, project: str, location: str) -
             project=project,
         )
         logging.info(f"Created bucket {bucket.name} in {bucket.location}")
+
+
+def create_public_bucket_if_not_exists(
+    bucket_name: str, project: str, location: str, ttl_days: int
+) -> None:
+    """Creates a publicly readable bucket whose objects expire, if it doesn't exist.
+
+    An existing bucket is never modified. If it does not grant public read
+    access, a warning is logged since its objects will not load by URL.
+
+    Args:
+        bucket_name: Name of the bucket to create
+        project: Google Cloud project ID
+        location: Location to create the bucket in
+        ttl_days: Age in days after which objects are deleted
+    """
+    storage_client = storage.Client(project=project)
+
+    try:
+        bucket = storage_client.get_bucket(bucket_name)
+    except exceptions.NotFound:
+        bucket = storage_client.bucket(bucket_name)
+        bucket.iam_configuration.uniform_bucket_level_access_enabled = True
+        bucket.add_lifecycle_delete_rule(age=ttl_days)
+        storage_client.create_bucket(bucket, location=location, project=project)
+
+        # Grant read on the whole bucket so objects need no per-object ACL
+        policy = bucket.get_iam_policy(requested_policy_version=3)
+        policy.bindings.append(
+            {"role": "roles/storage.objectViewer", "members": {"allUsers"}}
+        )
+        bucket.set_iam_policy(policy)
+        logging.info(f"Created public bucket {bucket_name} in {location}")
+        return
+
+    policy = bucket.get_iam_policy(requested_policy_version=3)
+    if not any(
+        binding["role"] == "roles/storage.objectViewer"
+        and "allUsers" in binding["members"]
+        for binding in policy.bindings
+    ):
+        logging.warning(
+            f"Bucket {bucket_name} does not grant allUsers "
+            "roles/storage.objectViewer; its objects will not be publicly readable"
+        )
@@ -0,0 +1,181 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import datetime
+import json
+import logging
+import random
+import types
+from pathlib import Path
+
+import pytest
+
+from app.utils import deployment
+
+RESOURCE_NAME = "projects/123/locations/us-central1/reasoningEngines/456"
+
+
+def reference_parse(env_vars_string: str) -> dict[str, str]:
+    """The original split/strip parser that parse_env_vars must agree with."""
+    env_vars = {}
+    for pair in env_vars_string.split(","):
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            env_vars[key.strip()] = value.strip()
+    return env_vars
+
+
+def remote_agent(name: str,
+                 service_account: str = "") -> types.SimpleNamespace:
+    return types.SimpleNamespace(api_resource=types.SimpleNamespace(
+        name=name, spec=types.SimpleNamespace(
+            service_account=service_account)))
+
+
+@pytest.mark.parametrize(
+    "env_vars_string, expected",
+    [
+        (None, {}),
+        ("", {}),
+        ("KEY=value", {
+            "KEY": "value"
+        }),
+        (" KEY = value ", {
+            "KEY": "value"
+        }),
+        (" A = 1 ,\tB=2 ", {
+            "A": "1",
+            "B": "2"
+        }),
+        ("=x,A=1", {
+            "": "x",
+            "A": "1"
+        }),
+        ("A=1=2,B=3", {
+            "A": "1=2",
+            "B": "3"
+        }),
+        ("A=1,", {
+            "A": "1"
+        }),
+        ("A=1,B,C=3", {
+            "A": "1",
+            "C": "3"
+        }),
+        ("A=1,A=2", {
+            "A": "2"
+        }),
+    ],
+)
+def test_parse_env_vars(env_vars_string: str | None,
+                        expected: dict[str, str]) -> None:
+    assert deployment.parse_env_vars(env_vars_string) == expected
+
+
+def test_parse_env_vars_matches_split_parser() -> None:
+    rng = random.Random(0)
+    for _ in range(5000):
+        env_vars_string = "".join(
+            rng.choice("ab =,\t") for _ in range(rng.randint(1, 12)))
+        assert deployment.parse_env_vars(env_vars_string) == reference_parse(
+            env_vars_string), repr(env_vars_string)
+
+
+def test_parse_env_vars_warns_on_every_call(
+        caplog: pytest.LogCaptureFixture) -> None:
+    with caplog.at_level(logging.WARNING):
+        deployment.parse_env_vars("A=1,bad")
+        deployment.parse_env_vars("A=1,bad")
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "Skipping malformed environment variable pair: bad",
+    ] * 2
+
+
+def test_parse_env_vars_returns_a_fresh_dict() -> None:
+    env_vars = deployment.parse_env_vars("A=1,B=2")
+    env_vars["NUM_WORKERS"] = "0"
+
+    assert deployment.parse_env_vars("A=1,B=2") == {"A": "1", "B": "2"}
+
+
+def test_write_deployment_metadata(tmp_path: Path) -> None:
+    metadata_file = tmp_path / "deployment_metadata.json"
+    metadata_file.write_text("stale")
+
+    deployment.write_deployment_metadata(remote_agent(RESOURCE_NAME),
+                                         str(metadata_file))
+
+    metadata = json.loads(metadata_file.read_text())
+    assert metadata["remote_agent_engine_id"] == RESOURCE_NAME
+    timestamp = datetime.datetime.fromisoformat(
+        metadata["deployment_timestamp"])
+    assert timestamp.utcoffset() == datetime.timedelta(0)
+    assert [path.name
+            for path in tmp_path.iterdir()] == ["deployment_metadata.json"]
+
+
+def test_write_deployment_metadata_keeps_old_file_on_failure(
+        monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    metadata_file = tmp_path / "deployment_metadata.json"
+    metadata_file.write_text('{"remote_agent_engine_id": "old"}')
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(deployment.os, "replace", fail)
+    with pytest.raises(OSError):
+        deployment.write_deployment_metadata(remote_agent(RESOURCE_NAME),
+                                             str(metadata_file))
+
+    assert metadata_file.read_text() == '{"remote_agent_engine_id": "old"}'
+
+
+def test_print_deployment_success(capsys: pytest.CaptureFixture[str]) -> None:
+    deployment.print_deployment_success(remote_agent(RESOURCE_NAME),
+                                        "us-central1", "my-project")
+
+    assert capsys.readouterr().out == (
+        "\n✅ Deployment successful! Test your agent: "
+        "notebooks/adk_app_testing.ipynb\n"
+        "Service Account: "
+        "service-123@gcp-sa-aiplatform-re.iam.gserviceaccount.com\n"
+        "\n📊 View in console: https://console.cloud.google.com/vertex-ai/"
+        "agents/locations/us-central1/agent-engines/456?project=my-project"
+        "\n\n")
+
+
+def test_print_deployment_success_uses_service_account(
+        capsys: pytest.CaptureFixture[str]) -> None:
+    deployment.print_deployment_success(
+        remote_agent(RESOURCE_NAME,
+                     "agent@my-project.iam.gserviceaccount.com"),
+        "us-central1", "my-project")
+
+    assert ("Service Account: agent@my-project.iam.gserviceaccount.com\n"
+            in capsys.readouterr().out)
+
+
+def test_print_deployment_success_unrecognized_name(
+        capsys: pytest.CaptureFixture[str],
+        caplog: pytest.LogCaptureFixture) -> None:
+    with caplog.at_level(logging.WARNING):
+        deployment.print_deployment_success(remote_agent("not-a-resource"),
+                                            "us-central1", "my-project")
+
+    out = capsys.readouterr().out
+    assert "✅ Deployment successful!" in out
+    assert "Agent Engine: not-a-resource\n" in out
+    assert "View in console" not in out
+    assert "not-a-resource" in caplog.text
@@ -0,0 +1,231 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import sqlite3
+import types
+from pathlib import Path
+from typing import Any, AsyncGenerator
+
+import pytest
+from google.adk.models import BaseLlm, LlmRequest, LlmResponse
+from google.adk.runners import InMemoryRunner
+from google.genai import types as genai_types
+
+from app import agent
+
+THEMES = "Chaotic, Mundane"
+VISION_TEXT = "Line one\nLine two\nLine three\nLine four"
+
+
+class FakeLlm(BaseLlm):
+    """Answers every request with the same vision and counts the calls."""
+
+    calls: int = 0
+
+    async def generate_content_async(
+            self,
+            llm_request: LlmRequest,
+            stream: bool = False) -> AsyncGenerator[LlmResponse, None]:
+        self.calls += 1
+        yield LlmResponse(content=genai_types.Content(
+            role="model", parts=[genai_types.Part(text=VISION_TEXT)]))
+
+
+class FakeImagen:
+    """Stands in for Imagen and the bucket upload, counting both."""
+
+    def __init__(self) -> None:
+        self.generate_calls = 0
+        self.upload_calls = 0
+        self.fail = False
+
+    def generate_images(self, vision_description: str) -> list[Any]:
+        self.generate_calls += 1
+        if self.fail:
+            return []
+        return [types.SimpleNamespace(_image_bytes=b"png")]
+
+    def upload(self, image_bytes: bytes) -> str:
+        self.upload_calls += 1
+        return f"https://storage.googleapis.com/bucket/{self.upload_calls}.png"
+
+
+@pytest.fixture
+def llm(monkeypatch: pytest.MonkeyPatch) -> FakeLlm:
+    fake = FakeLlm(model="fake-llm")
+    monkeypatch.setattr(agent.text_generator, "model", fake)
+    return fake
+
+
+@pytest.fixture
+def imagen(monkeypatch: pytest.MonkeyPatch) -> FakeImagen:
+    fake = FakeImagen()
+    monkeypatch.setattr(agent, "_generate_images", fake.generate_images)
+    monkeypatch.setattr(agent, "_upload_vision_image", fake.upload)
+    # Keep the real Vertex AI and GCS clients out of unit tests.
+    monkeypatch.setattr(agent, "start_background_setup", lambda: None)
+    return fake
+
+
+@pytest.fixture
+def cache_db(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> Path:
+    db = tmp_path / "visions.db"
+    monkeypatch.setattr(agent, "VISION_CACHE_DB", str(db))
+    monkeypatch.setattr(agent, "get_vision_themes", lambda: THEMES)
+    return db
+
+
+async def run_oracle() -> dict[str, str]:
+    """Runs the whole pipeline in a fresh session and returns its response."""
+    runner = InMemoryRunner(agent=agent.root_agent, app_name="oracle")
+    session = await runner.session_service.create_session(app_name="oracle",
+                                                          user_id="pilgrim")
+    message = genai_types.Content(role="user",
+                                  parts=[genai_types.Part(text="A vision")])
+    events = [
+        event async for event in runner.run_async(
+            user_id="pilgrim", session_id=session.id, new_message=message)
+    ]
+    return json.loads(events[-1].content.parts[0].text)
+
+
+def cached_rows(db: Path) -> list[tuple[Any, ...]]:
+    with sqlite3.connect(db) as conn:
+        return conn.execute(
+            "SELECT themes, vision_text, image_url, created_at FROM visions"
+        ).fetchall()
+
+
+@pytest.mark.asyncio
+async def test_second_vision_is_served_from_cache(llm: FakeLlm,
+                                                  imagen: FakeImagen,
+                                                  cache_db: Path) -> None:
+    first = await run_oracle()
+    second = await run_oracle()
+
+    assert first == {
+        "vision_text": VISION_TEXT,
+        "image_url": "https://storage.googleapis.com/bucket/1.png",
+    }
+    assert second == first
+    # The hit skips both the model and the image generator.
+    assert llm.calls == 1
+    assert imagen.generate_calls == 1
+    assert imagen.upload_calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_does_not_refresh_entry(llm: FakeLlm,
+                                                imagen: FakeImagen,
+                                                cache_db: Path) -> None:
+    await run_oracle()
+    stored = cached_rows(cache_db)
+    await run_oracle()
+
+    assert len(stored) == 1
+    assert cached_rows(cache_db) == stored
+
+
+@pytest.mark.asyncio
+async def test_vision_without_image_is_not_cached(llm: FakeLlm,
+                                                  imagen: FakeImagen,
+                                                  cache_db: Path) -> None:
+    imagen.fail = True
+    failed = await run_oracle()
+    imagen.fail = False
+    retried = await run_oracle()
+
+    assert failed["image_url"] == ""
+    assert retried[
+        "image_url"] == "https://storage.googleapis.com/bucket/1.png"
+    assert llm.calls == 2
+    assert imagen.generate_calls == 2
+
+
+@pytest.mark.asyncio
+async def test_failed_image_evicts_expired_entry(
+        monkeypatch: pytest.MonkeyPatch, llm: FakeLlm, imagen: FakeImagen,
+        cache_db: Path) -> None:
+    await run_oracle()
+    monkeypatch.setattr(agent, "VISION_CACHE_TTL_SECONDS", 0)
+    imagen.fail = True
+    await run_oracle()
+
+    assert llm.calls == 2
+    assert cached_rows(cache_db) == []
+
+
+@pytest.mark.asyncio
+async def test_expired_vision_is_regenerated(monkeypatch: pytest.MonkeyPatch,
+                                             llm: FakeLlm, imagen: FakeImagen,
+                                             cache_db: Path) -> None:
+    await run_oracle()
+    monkeypatch.setattr(agent, "VISION_CACHE_TTL_SECONDS", 0)
+    second = await run_oracle()
+
+    assert second["image_url"] == "https://storage.googleapis.com/bucket/2.png"
+    assert llm.calls == 2
+    assert imagen.generate_calls == 2
+    assert [row[2] for row in cached_rows(cache_db)] == [second["image_url"]]
+
+
+@pytest.mark.asyncio
+async def test_unreadable_cache_does_not_fail_query(
+        monkeypatch: pytest.MonkeyPatch, llm: FakeLlm, imagen: FakeImagen,
+        cache_db: Path) -> None:
+    # A directory cannot be opened as a database, so every cache call fails.
+    monkeypatch.setattr(agent, "VISION_CACHE_DB", str(cache_db.parent))
+    response = await run_oracle()
+
+    assert response[
+        "image_url"] == "https://storage.googleapis.com/bucket/1.png"
+    assert llm.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cache_recovers_after_file_is_removed(llm: FakeLlm,
+                                                    imagen: FakeImagen,
+                                                    cache_db: Path) -> None:
+    await run_oracle()
+    cache_db.unlink()
+    await run_oracle()
+    await run_oracle()
+
+    assert llm.calls == 2
+    assert len(cached_rows(cache_db)) == 1
+
+
+@pytest.mark.asyncio
+async def test_image_generator_skips_cached_url(imagen: FakeImagen,
+                                                cache_db: Path) -> None:
+    runner = InMemoryRunner(agent=agent.image_generator, app_name="oracle")
+    session = await runner.session_service.create_session(
+        app_name="oracle",
+        user_id="pilgrim",
+        state={
+            "vision_themes": THEMES,
+            "vision_text": VISION_TEXT,
+            "generated_image_url": "https://example.com/cached.png",
+        })
+    message = genai_types.Content(role="user",
+                                  parts=[genai_types.Part(text="A vision")])
+    events = [
+        event async for event in runner.run_async(
+            user_id="pilgrim", session_id=session.id, new_message=message)
+    ]
+
+    assert events == []
+    assert imagen.generate_calls == 0
+    assert imagen.upload_calls == 0